@@ -1,20 +1,73 @@
 # mypy: ignore-errors
-import datetime
 import functools
+import itertools
+import logging
+import math
 import os
+import socket
+import threading
+import time
 import typing as t
 import uuid
-from inspect import isclass, signature
-
+import warnings
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future
+from inspect import Parameter, isclass, signature
+
+import orjson
+import xxhash
 from pottery.cache import CacheInfo
 from pydantic import BaseModel
-from redis import Redis
+from redis import BlockingConnectionPool, Redis
+
+from src.repository import (
+    PydanticRedisRepository,
+    RedisRepository,
+    _escape_glob,
+    _fast_uuid,
+)
 
-from src.repository import PydanticRedisRepository, RedisRepository
+logger = logging.getLogger(__name__)
 
 # Default Redis connection settings
 _default_url: t.Final[str] = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
-_default_redis: t.Final[Redis] = Redis.from_url(_default_url, socket_timeout=1)
+_default_pool_size: t.Final[int] = int(os.environ.get("REDIS_POOL_SIZE", "64"))
+# Seconds to wait for a free connection of exhausted pool before ConnectionError
+_default_pool_timeout: t.Final[float] = float(
+    os.environ.get("REDIS_POOL_TIMEOUT", "1")
+)
+# Size of client-side cache (RESP3 CLIENT TRACKING, Redis 6+), 0 disables it.
+# Warm hits are then served from process memory, Redis pushes invalidations.
+_client_cache_size: t.Final[int] = int(os.environ.get("REDIS_CLIENT_CACHE_SIZE", "0"))
+_client_cache_options: t.Dict[str, t.Any] = {}
+if _client_cache_size > 0:
+    # Client-side caching is only available since redis-py 5.1
+    from redis.cache import CacheConfig
+
+    _client_cache_options = {
+        "protocol": 3,
+        "cache_config": CacheConfig(max_size=_client_cache_size),
+    }
+# TCP keepalive tuning, these socket options are not available on every platform
+_keepalive_options: t.Final[t.Dict[int, int]] = {
+    getattr(socket, name): value
+    for name, value in (("TCP_KEEPIDLE", 60), ("TCP_KEEPINTVL", 30), ("TCP_KEEPCNT", 3))
+    if hasattr(socket, name)
+}
+# Shared pool, waits up to _default_pool_timeout for a free connection when exhausted
+default_pool: t.Final[BlockingConnectionPool] = BlockingConnectionPool.from_url(
+    _default_url,
+    decode_responses=False,  # Payloads are passed to orjson/msgpack as raw bytes
+    max_connections=_default_pool_size,
+    timeout=_default_pool_timeout,
+    socket_timeout=1,
+    socket_keepalive=True,
+    socket_keepalive_options=_keepalive_options,
+    health_check_interval=30,
+    **_client_cache_options,
+)
+_default_redis: t.Final[Redis] = Redis(connection_pool=default_pool)
 
 # Type definition for JSON serializable values that can be cached
 JSONTypes = t.Union[
@@ -26,58 +79,555 @@ F = t.TypeVar("F", bound=t.Callable[..., JSONTypes])
 class ResponseRepository(RedisRepository):
     """Repository for caching HTTP responses"""
 
-    def _serialize(self, obj: t.Any) -> str:
-        return obj.json()
+    def _serialize(self, obj: t.Any) -> bytes:
+        # Custom json_encoders are only applied by pydantic's own JSON dump
+        config = getattr(type(obj), "model_config", None)
+        if config is None:
+            config = obj.__config__
+        if _json_encoders(config):
+            return obj.json().encode()
+        return super()._serialize(obj.dict())
+
+
+def _json_encoders(config: t.Any) -> t.Any:
+    if isinstance(config, dict):  # pydantic v2 ConfigDict
+        return config.get("json_encoders")
+    return getattr(config, "json_encoders", None)
+
 
+# Argument types encoded by orjson without any ambiguity, calls with only
+# these arguments skip the canonicalization walk below
+_PLAIN_ARG_TYPES: t.Final[t.FrozenSet[type]] = frozenset((str, int, bool, type(None)))
 
-def _arg_hash(*args: t.Hashable, **kwargs: t.Hashable) -> int:
+
+def _canonical(obj: t.Any) -> t.Any:
+    """
+    Slow path of _arg_hash: converts argument to JSON value that keeps its
+    type. Every JSON object in the result is a single-key type tag, so e.g.
+    tuple and list, UUID and its str, {1: ..} and {"1": ..} give different keys.
+    """
+    type_ = type(obj)
+    if type_ in _PLAIN_ARG_TYPES:
+        if type_ is int and not -(2**63) <= obj < 2**64:
+            return {"__int__": str(obj)}
+        return obj
+    if type_ is float:
+        # orjson writes nan and inf as null
+        return obj if math.isfinite(obj) else {"__float__": repr(obj)}
+    if type_ is list:
+        return [_canonical(el) for el in obj]
+    if type_ is tuple:
+        return {"__tuple__": [_canonical(el) for el in obj]}
+    if type_ is dict:
+        return {
+            "__dict__": sorted(
+                [_canonical_bytes(k).decode(), _canonical(v)] for k, v in obj.items()
+            )
+        }
+    if type_ is set or type_ is frozenset:
+        # Iteration order of sets depends on PYTHONHASHSEED
+        return {"__set__": sorted(_canonical_bytes(el).decode() for el in obj)}
+    if isinstance(obj, BaseModel):
+        return {"__model__": [type_.__qualname__, _canonical(obj.dict())]}
+    if hasattr(obj, "to_json"):
+        return {"__json__": [type_.__qualname__, _canonical(obj.to_json())]}
+    # Values orjson encodes natively: UUID, datetime, enum, dataclass, subclasses
+    # of builtins. Anything else has no stable representation to key on.
+    try:
+        payload = orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+    except TypeError:
+        raise TypeError(
+            f"Cannot build cache key from {type_.__qualname__!r} argument, "
+            "define `to_json` method for it"
+        ) from None
+    return {"__native__": [type_.__qualname__, payload.decode()]}
+
+
+def _canonical_bytes(obj: t.Any) -> bytes:
+    return orjson.dumps(_canonical(obj), option=orjson.OPT_SORT_KEYS)
+
+
+def _arg_hash(*args: t.Hashable, **kwargs: t.Hashable) -> str:
     """
     Generate a hash from function arguments for cache key.
-    Handles special case of Pydantic models by converting them to JSON first.
+    Arguments are dumped to canonical JSON (sorted keys) and hashed with xxh3,
+    so the same call produces the same key in every process, unlike `hash()`
+    which is randomized per interpreter.
+    """
+    payload = None
+    if all(type(el) in _PLAIN_ARG_TYPES for el in args) and all(
+        type(el) in _PLAIN_ARG_TYPES for el in kwargs.values()
+    ):
+        try:
+            payload = orjson.dumps((args, kwargs), option=orjson.OPT_SORT_KEYS)
+        except TypeError:
+            pass  # Integer out of 64-bit range
+    if payload is None:
+        # Same layout as above, only non-plain values are type tagged
+        payload = orjson.dumps(
+            (
+                [_canonical(el) for el in args],
+                {k: _canonical(v) for k, v in kwargs.items()},
+            ),
+            option=orjson.OPT_SORT_KEYS,
+        )
+    return xxhash.xxh3_64_hexdigest(payload)
+
+
+def _method_hash(args: tuple, kwargs: t.Dict[str, t.Any]) -> str:
+    return _arg_hash(*args[1:], **kwargs)  # Skip 'self'/'cls' arg
+
+
+def _response_hash(args: tuple, kwargs: t.Dict[str, t.Any]) -> str:
+    request = args[0]
+    user_id = str(request.auth.identity.id) if request.auth.identity else ""
+    return _arg_hash(user_id, *args[1:], **kwargs)
+
+
+def _plain_hash(args: tuple, kwargs: t.Dict[str, t.Any]) -> str:
+    return _arg_hash(*args, **kwargs)
+
+
+class _CacheStats:
+    """
+    Local hits/misses counters of a cached function.
+    Hot path only calls next() on C-level itertools.count, reading current
+    value consumes one step, which is compensated by *_base offsets.
     """
 
-    def make_hashable(el):
-        if isinstance(el, BaseModel):
-            return el.json()
-        return el
+    __slots__ = ("hits", "misses", "_hits_base", "_misses_base", "_lock")
 
-    # Convert kwargs and args to frozenset for hashing
-    kwargs_items = frozenset({(k, make_hashable(v)) for k, v in kwargs.items()})
-    args = frozenset([make_hashable(el) for el in args])
-    return hash((args, kwargs_items))
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.hits = itertools.count()
+            self.misses = itertools.count()
+            self._hits_base = 0
+            self._misses_base = 0
+
+    def add(self, hits: int, misses: int) -> None:
+        with self._lock:
+            self._hits_base -= hits
+            self._misses_base -= misses
+
+    def snapshot(self) -> t.Tuple[int, int]:
+        with self._lock:
+            hits = next(self.hits) - self._hits_base
+            misses = next(self.misses) - self._misses_base
+            self._hits_base += 1
+            self._misses_base += 1
+        return hits, misses
+
+
+class _L1Cache:
+    """
+    Size-bounded in-process LRU in front of Redis. Entries live at most `ttl`
+    seconds locally and are dropped earlier when Redis reports a change of
+    the key via keyspace notifications. Until the notification subscriber is
+    running, values are not kept locally at all.
+    """
+
+    def __init__(self, maxsize: int, ttl: t.Optional[int], prefix: str) -> None:
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._prefix = prefix
+        # hash -> (value, deadline of local entry or None)
+        self._data: "OrderedDict[str, t.Tuple[t.Any, t.Optional[float]]]" = (
+            OrderedDict()
+        )
+        # hash -> number of own writes whose `set` notification is yet to come
+        self._own_writes: "OrderedDict[str, int]" = OrderedDict()
+        # Bumped on every invalidation, so values read from Redis before the
+        # invalidation are not put after it
+        self._generation = 0
+        self._listening = False
+        self._lock = threading.Lock()
+        _l1_caches.add(self)
+
+    def get(self, hash_: str) -> t.Any:
+        with self._lock:
+            entry = self._data.get(hash_)
+            if entry is None:
+                return None
+            value, deadline = entry
+            if deadline is not None and deadline <= time.monotonic():
+                del self._data[hash_]
+                return None
+            self._data.move_to_end(hash_)
+            return value
+
+    def put(self, hash_: str, value: t.Any, generation: int) -> None:
+        deadline = None if self._ttl is None else time.monotonic() + self._ttl
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._data[hash_] = (value, deadline)
+            self._data.move_to_end(hash_)
+            if len(self._data) > self._maxsize:
+                self._data.popitem(last=False)
+
+    def discard(self, hash_: str) -> None:
+        with self._lock:
+            self._generation += 1
+            self._data.pop(hash_, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+
+    def on_event(self, hash_: str, event: bytes) -> None:
+        """Handle keyspace notification of the key, skipping own writes"""
+        with self._lock:
+            if event == b"set":
+                pending = self._own_writes.get(hash_)
+                if pending:
+                    self._forget_write(hash_, pending)
+                    return
+            self._generation += 1
+            self._data.pop(hash_, None)
+
+    def _expect_write(self, hash_: str) -> None:
+        with self._lock:
+            self._own_writes[hash_] = self._own_writes.get(hash_, 0) + 1
+            self._own_writes.move_to_end(hash_)
+            # Notifications may be disabled on the server, do not grow forever
+            if len(self._own_writes) > self._maxsize:
+                self._own_writes.popitem(last=False)
+
+    def _write_done(self, hash_: str, future: "Future[t.Any]") -> None:
+        # Failed or coalesced writes produce no notification
+        if future.cancelled() or future.exception() is not None:
+            with self._lock:
+                self._forget_write(hash_, self._own_writes.get(hash_))
+
+    def _forget_write(self, hash_: str, pending: t.Optional[int]) -> None:
+        if pending is None:
+            return
+        if pending > 1:
+            self._own_writes[hash_] = pending - 1
+        else:
+            del self._own_writes[hash_]
+
+    def _reset_after_fork(self) -> None:
+        # Subscriber thread of the parent does not exist in the child
+        self._lock = threading.Lock()
+        self._listening = False
+        self._generation += 1
+        self._data.clear()
+        self._own_writes.clear()
+
+    def wrap(
+        self,
+        redis: Redis,
+        fetch: t.Callable[[str], t.Any],
+        store: t.Callable[[str, t.Any], "Future[t.Any]"],
+    ) -> t.Tuple[t.Callable[[str], t.Any], t.Callable[[str, t.Any], t.Any]]:
+        """Put L1 lookup in front of fetch and populate it on both hit and miss"""
+
+        def l1_fetch(hash_: str) -> t.Any:
+            value = self.get(hash_)
+            if value is None:
+                if not self._listening:
+                    self._listening = _l1_invalidator(redis).watch(self._prefix, self)
+                generation = self._generation
+                value = fetch(hash_)
+                if value is not None and self._listening:
+                    self.put(hash_, value, generation)
+            return value
+
+        def l1_store(hash_: str, value: t.Any) -> None:
+            if not self._listening:
+                store(hash_, value)
+                return
+
+            generation = self._generation
+            self._expect_write(hash_)
+            try:
+                future = store(hash_, value)
+            except BaseException:
+                with self._lock:
+                    self._forget_write(hash_, self._own_writes.get(hash_))
+                raise
+            future.add_done_callback(functools.partial(self._write_done, hash_))
+            self.put(hash_, value, generation)
+
+        return l1_fetch, l1_store
+
+
+class _L1Invalidator:
+    """
+    Keyspace notification subscriber shared by all L1 caches of one redis
+    client. It is started lazily on first lookup, so decorating a function
+    does not connect to Redis. Requires `notify-keyspace-events` to include
+    `K$gxe` on Redis server.
+    """
+
+    def __init__(self, redis: Redis) -> None:
+        self._redis = redis
+        self._pubsub: t.Any = None
+        self._thread: t.Optional[threading.Thread] = None
+        # Subscribed pattern -> length of its prefix and caches to invalidate
+        self._patterns: t.Dict[bytes, t.Tuple[int, t.List[_L1Cache]]] = {}
+        self._lock = threading.Lock()
+
+    def watch(self, prefix: str, l1: _L1Cache) -> bool:
+        """Subscribe L1 cache to changes of prefixed keys, returns success"""
+        pattern = f"__keyspace@*__:{_escape_glob(prefix)}*"
+        try:
+            with self._lock:
+                if pattern.encode() not in self._patterns:
+                    if self._pubsub is None:
+                        self._check_config()
+                        self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                    self._pubsub.psubscribe(**{pattern: self._handle})
+                    self._patterns[pattern.encode()] = (len(prefix.encode()), [])
+                self._patterns[pattern.encode()][1].append(l1)
+
+                if self._thread is None:
+                    self._thread = self._pubsub.run_in_thread(
+                        sleep_time=1, daemon=True, exception_handler=self._on_error
+                    )
+        except Exception:
+            logger.warning("Failed to subscribe to keyspace notifications", exc_info=True)
+            return False
+        return True
+
+    def _check_config(self) -> None:
+        try:
+            config = self._redis.config_get("notify-keyspace-events")
+        except Exception:
+            # CONFIG is often disabled on managed Redis
+            logger.debug("Failed to read notify-keyspace-events", exc_info=True)
+            return
+        flags = next(iter(config.values()), "")
+        if isinstance(flags, bytes):
+            flags = flags.decode()
+        if "K" not in flags or not ("A" in flags or all(c in flags for c in "$gxe")):
+            logger.warning(
+                "Redis notify-keyspace-events is %r, L1 cache only sees changes "
+                "from other processes after local expiry, enable at least 'K$gxe'",
+                flags,
+            )
+
+    def _handle(self, message: t.Dict[str, t.Any]) -> None:
+        pattern, channel, event = (
+            field.encode() if isinstance(field, str) else field
+            for field in (message["pattern"], message["channel"], message["data"])
+        )
+        # TTL refreshes (EXPIRE, GETEX, SET EX) do not change the value
+        if event == b"expire":
+            return
+        # Channel looks like b"__keyspace@<db>__:<prefix><hash>"
+        r_key = channel.split(b":", 1)[1]
+        if r_key.endswith(b":lock"):  # Stampede lock of the key, not a value
+            return
+        prefix_len, caches = self._patterns[pattern]
+        hash_ = r_key[prefix_len:].decode()
+        for l1 in caches:
+            l1.on_event(hash_, event)
+
+    def _on_error(self, exc: BaseException, pubsub: t.Any, thread: t.Any) -> None:
+        # Notifications may have been missed, so local entries can not be trusted
+        logger.warning("Keyspace notification listener failed: %r", exc)
+        for _, caches in list(self._patterns.values()):
+            for l1 in caches:
+                l1.clear()
+        time.sleep(1)
+
+
+_l1_caches: "weakref.WeakSet[_L1Cache]" = weakref.WeakSet()
+_l1_invalidators: t.Dict[int, _L1Invalidator] = {}
+_l1_invalidators_lock = threading.Lock()
+
+
+def _l1_invalidator(redis: Redis) -> _L1Invalidator:
+    with _l1_invalidators_lock:
+        invalidator = _l1_invalidators.get(id(redis))
+        if invalidator is None:
+            invalidator = _l1_invalidators[id(redis)] = _L1Invalidator(redis)
+        return invalidator
+
+
+def _reset_l1_after_fork() -> None:
+    """Forked child has no subscriber threads, so L1 caches subscribe again"""
+    global _l1_invalidators_lock
+    _l1_invalidators_lock = threading.Lock()
+    _l1_invalidators.clear()
+    for l1 in list(_l1_caches):
+        l1._reset_after_fork()
+
+
+os.register_at_fork(after_in_child=_reset_l1_after_fork)
+
+
+# Returns {1, value} on hit, {2} if lock is acquired by caller, {0} if it is held
+_GET_OR_LOCK_SCRIPT: t.Final[str] = """
+local v = redis.call('GET', KEYS[1])
+if v then
+    if tonumber(ARGV[3]) > 0 then
+        redis.call('EXPIRE', KEYS[1], ARGV[3])
+    end
+    return {1, v}
+end
+if redis.call('SET', KEYS[2], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return {2}
+end
+return {0}
+"""
+# Deletes lock only if it is still owned by the caller
+_UNLOCK_SCRIPT: t.Final[str] = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+_LOCK_POLL_INTERVAL: t.Final[float] = 0.05
+
+
+def _make_single_flight(
+    cache: RedisRepository,
+    redis: Redis,
+    lock_timeout: float,
+    ex_seconds: t.Optional[int],
+    sliding: bool,
+) -> t.Tuple[
+    t.Callable[[str], t.Any],
+    t.Callable[[str, t.Any], t.Any],
+    t.Callable[[str], None],
+]:
+    """
+    Build fetch/store/abort callables with stampede protection. On miss only
+    the caller that acquired the lock gets None and computes the value, the
+    others poll until the value appears or lock expires (e.g. the owner
+    crashed). abort releases the lock if computing or storing has failed.
+    """
+    get_or_lock = redis.register_script(_GET_OR_LOCK_SCRIPT)
+    unlock = redis.register_script(_UNLOCK_SCRIPT)
+    # PX only accepts positive integer milliseconds
+    lock_ms = max(int(lock_timeout * 1000), 1)
+    refresh = ex_seconds if sliding and ex_seconds is not None else 0
+    # Lock tokens owned by current thread, keyed by hash, so nested cached
+    # calls on the same thread do not overwrite each other's token
+    local = threading.local()
+
+    def owned_tokens() -> t.Dict[str, str]:
+        try:
+            return local.tokens
+        except AttributeError:
+            local.tokens = {}
+            return local.tokens
+
+    def fetch(hash_: str) -> t.Any:
+        r_key = cache._key(hash_)
+        lock_key = r_key + b":lock"
+        token = _fast_uuid()
+        deadline = time.monotonic() + lock_timeout
+
+        while True:
+            result = get_or_lock(keys=[r_key, lock_key], args=[token, lock_ms, refresh])
+            if result[0] == 1:
+                return cache._decode(result[1])
+            if result[0] == 2:
+                owned_tokens()[hash_] = token
+                return None
+            if time.monotonic() >= deadline:
+                # Give up waiting and compute without the lock
+                return None
+            time.sleep(_LOCK_POLL_INTERVAL)
+
+    def store(hash_: str, value: t.Any) -> "Future[t.Any]":
+        future = cache.save_async(hash_, value, ex=ex_seconds)
+        token = owned_tokens().pop(hash_, None)
+        if token is not None:
+            lock_key = cache._key(hash_) + b":lock"
+
+            # Release the lock only after the value is visible to waiters.
+            # Cancelled write was replaced by a newer one that waiters will
+            # see, and cancel() runs callbacks under the pending writes lock,
+            # so no round trip is made then and the lock just expires.
+            def release(future: "Future[t.Any]") -> None:
+                if not future.cancelled():
+                    unlock(keys=[lock_key], args=[token])
+
+            future.add_done_callback(release)
+        return future
+
+    def abort(hash_: str) -> None:
+        token = owned_tokens().pop(hash_, None)
+        if token is not None:
+            unlock(keys=[cache._key(hash_) + b":lock"], args=[token])
+
+    return fetch, store, abort
+
+
+def _noop_abort(hash_: str) -> None:
+    pass
+
+
+def _make_wrapper(
+    func: F,
+    make_hash: t.Callable[[tuple, t.Dict[str, t.Any]], str],
+    fetch: t.Callable[[str], t.Any],
+    store: t.Callable[[str, t.Any], t.Any],
+    abort: t.Callable[[str], None],
+    stats: _CacheStats,
+) -> F:
+    """
+    Build cache wrapper at decoration time. make_hash is one of *_hash
+    functions above picked for the function type, so the hot path does not
+    re-check is_class_method/is_response_method per call. abort is called
+    when computing or storing a missed value fails.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args: t.Hashable, **kwargs: t.Hashable) -> JSONTypes:
+        hash_ = make_hash(args, kwargs)
+
+        return_value = fetch(hash_)
+        if return_value is None:
+            try:
+                return_value = func(*args, **kwargs)
+                store(hash_, return_value)
+            except BaseException:
+                abort(hash_)
+                raise
+            next(stats.misses)
+        else:
+            next(stats.hits)
+
+        return return_value
+
+    return t.cast(F, wrapper)
 
 
 def random_key(
     *,
-    redis: Redis,
+    redis: t.Optional[Redis] = None,
     prefix: str = "investfuture:",
-    num_tries: int = 3,
+    num_tries: t.Optional[int] = None,
 ) -> str:
     """
-    Generate a random Redis key that doesn't already exist.
-    Uses UUID4 for uniqueness and retries if collision occurs.
+    Generate a random Redis key.
+    Uses UUID4 for uniqueness, collision probability is negligible, so no
+    round trip to Redis is made to check whether the key is already taken.
 
     Args:
-        redis: Redis connection
+        redis: Deprecated, ignored
         prefix: Key prefix to use
-        num_tries: Number of attempts to generate unique key
+        num_tries: Deprecated, ignored
     """
-    if not isinstance(num_tries, int):
-        raise TypeError("num_tries must be an int >= 0")
-    if num_tries < 0:
-        raise ValueError("num_tries must be an int >= 0")
-    if num_tries == 0:
-        raise Exception(redis)
-
-    uuid4 = str(uuid.uuid4())
-    key = prefix + uuid4
-    if redis.exists(key):  # Available since Redis 1.0.0
-        key = random_key(
-            redis=redis,
-            prefix=prefix,
-            num_tries=num_tries - 1,
+    if redis is not None or num_tries is not None:
+        warnings.warn(
+            "`redis` and `num_tries` arguments of random_key are ignored "
+            "and will be removed in the next release",
+            DeprecationWarning,
+            stacklevel=2,
         )
-    return key
+    return prefix + uuid.uuid4().hex
 
 
 def cache(
@@ -87,11 +637,16 @@ def cache(
     redis: t.Optional[Redis] = None,
     prefix: t.Optional[str] = None,
     timeout: t.Optional[int] = 60,
+    sliding: bool = False,
+    compress: bool = False,
+    lock_timeout: t.Optional[float] = None,
+    l1_maxsize: int = 0,
     r_type: t.Optional[t.Any] = None,
 ) -> t.Callable[[F], F]:
     """Redis-backed caching decorator with an API like functools.lru_cache().
 
-    Arguments to the original underlying function must be hashable, and return
+    Arguments to the original underlying function must be JSON serializable by
+    orjson, pydantic models or objects with `to_json` method, and return
     values from the function must be JSON serializable.
 
     @param is_class_method: Whether decorated function is a class method
@@ -99,6 +654,19 @@ def cache(
     @param redis: Redis connection to use, defaults to _default_redis
     @param prefix: Key prefix for Redis cache entries
     @param timeout: Cache TTL in seconds
+    @param sliding: Whether every cache hit should refresh the TTL. Such lookups
+                    always go to Redis, bypassing client-side cache
+    @param compress: Whether to zstd-compress cached values above 1 KB
+    @param lock_timeout: Enables stampede protection: on miss only one caller
+                         computes the value, others wait for it up to this
+                         many seconds. Should exceed function execution time
+    @param l1_maxsize: Size of in-process LRU kept in front of Redis, 0 disables
+                       it. Local entries expire after `timeout` and are
+                       invalidated through Redis keyspace notifications, so
+                       `notify-keyspace-events` must be enabled (e.g. `K$gxe`),
+                       otherwise changes from other processes are only seen
+                       after local expiry. L1 hits return the same object to
+                       every caller. Can not be combined with `sliding`
     @param r_type: Expected return type of decorated function
 
     Additionally, this decorator provides the following functions:
@@ -113,6 +681,13 @@ def cache(
         call the original underlying function, then cache the results for
         future calls to f(*args, **kwargs).
 
+    f.many([(args, kwargs), ...])
+        Batched version of f(*args, **kwargs). Looks up every argset with a
+        single MGET, calls the original function only for misses and saves
+        their results in one pipeline. Results are returned in input order.
+        For response methods every request in the batch is keyed by its own
+        user. Sliding TTL is not refreshed by this lookup.
+
     f.cache_info()
         Return a NamedTuple showing hits, misses, maxsize, and currsize.  This
         information is helpful for measuring the effectiveness of the cache.
@@ -127,12 +702,19 @@ def cache(
         hits/misses may be incorrect in multiprocess/distributed applications.
 
         That said, currsize is always correct, even if other remote processes
-        modify the same Redis-backed redis_cache() key.
+        modify the same Redis-backed redis_cache() key. It is counted with
+        SCAN over the prefix, so calls take time proportional to the keyspace.
 
     f.cache_clear()
         Clear/invalidate the entire cache (for all args/kwargs previously
         cached) for your function.
 
+    On cache miss the result is written to Redis in a background thread, so
+    the caller does not wait for the write. Consequently an immediate call
+    with the same args (e.g. from another process) may still miss the cache.
+    Invalidations made in the same process wait for pending writes of the
+    key, so an invalidated value is never written back afterwards.
+
     In general, you should only use redis_cache() when you want to reuse
     previously computed values.  Accordingly, it doesn't make sense to cache
     functions with side-effects or impure functions such as time() or random().
@@ -140,19 +722,27 @@ def cache(
     However, unlike functools.lru_cache(), redis_cache() reconstructs
     previously cached objects on each cache hit.  Therefore, you can use
     redis_cache() for a function that needs to create a distinct mutable object
-    on each call.
+    on each call.  This does not hold with l1_maxsize > 0: L1 hits return the
+    very same object, so it must not be mutated by callers.
     """
 
     def decorator(func: F) -> F:
         nonlocal prefix, redis, r_type
 
+        if lock_timeout is not None and lock_timeout <= 0:
+            raise ValueError("lock_timeout must be positive")
+
+        # L1 hits never reach Redis, so they could not refresh its TTL
+        if sliding and l1_maxsize > 0:
+            raise ValueError("sliding TTL can not be combined with l1_maxsize")
+
         # Use default Redis connection if none provided
         if redis is None:
             redis = _default_redis
 
         # Generate random prefix if none provided
         if prefix is None:
-            prefix = random_key(redis=t.cast(Redis, redis))
+            prefix = random_key()
 
         # Get return type from function signature if not specified
         if r_type is None:
@@ -160,81 +750,107 @@ def cache(
 
         # Select appropriate repository based on return type
         if is_response_method:
-            cache = ResponseRepository(redis_client=redis, prefix=prefix)
+            cache = ResponseRepository(
+                redis_client=redis, prefix=prefix, compress=compress
+            )
         elif isclass(r_type) and issubclass(r_type, BaseModel):
             cache = PydanticRedisRepository(
-                redis_client=redis, prefix=prefix, obj_type=r_type
+                redis_client=redis, prefix=prefix, obj_type=r_type, compress=compress
             )
         else:
-            cache = RedisRepository(redis_client=redis, prefix=prefix)
+            cache = RedisRepository(redis_client=redis, prefix=prefix, compress=compress)
 
-        hits, misses = 0, 0
-        expires_after = datetime.timedelta(seconds=timeout)
+        stats = _CacheStats()
+        # Redis accepts TTL as integer seconds, so no timedelta is needed
+        ex_seconds = None if timeout is None else int(timeout)
 
-        @functools.wraps(func)
-        def wrapper(*args: t.Hashable, **kwargs: t.Hashable) -> JSONTypes:
-            """Main wrapper that handles cache lookup and storage"""
-            nonlocal hits, misses
-
-            # Generate cache key based on function type and arguments
-            if is_class_method:
-                hash_ = _arg_hash(*args[1:], **kwargs)  # Skip 'self'/'cls' arg
-            elif is_response_method:
-                request = args[0]
-                user_id = str(request.auth.identity.id) if request.auth.identity else ""
-                hash_ = _arg_hash(user_id, *args[1:], **kwargs)
+        abort = _noop_abort
+        if lock_timeout is not None:
+            fetch, store, abort = _make_single_flight(
+                cache, redis, lock_timeout, ex_seconds, sliding
+            )
+        else:
+            # Sliding TTL is refreshed with GETEX in the same round trip as lookup
+            if sliding and ex_seconds is not None:
+                fetch = functools.partial(cache.get, ex=ex_seconds)
             else:
-                hash_ = _arg_hash(*args, **kwargs)
+                fetch = cache.get
+            store = functools.partial(cache.save_async, ex=ex_seconds)
+
+        l1: t.Optional[_L1Cache] = None
+        if l1_maxsize > 0:
+            l1 = _L1Cache(l1_maxsize, ex_seconds, prefix)
+            fetch, store = l1.wrap(redis, fetch, store)
+
+        # Pick cache key scheme for function type
+        if is_class_method:
+            make_hash = _method_hash
+        elif is_response_method:
+            make_hash = _response_hash
+        else:
+            make_hash = _plain_hash
 
-            # Try to get value from cache
-            return_value = cache[hash_]
-            if return_value is None:
-                # Cache miss - call function and store result
-                return_value = func(*args, **kwargs)
-                cache.save(hash_, return_value, ex=expires_after)
-                misses += 1
-            else:
-                hits += 1
+        wrapper = _make_wrapper(func, make_hash, fetch, store, abort, stats)
 
-            return return_value
+        def many(
+            arglist: t.Iterable[t.Tuple[tuple, t.Dict[str, t.Any]]]
+        ) -> t.List[JSONTypes]:
+            """Batched lookup, one MGET for all argsets and one pipeline for misses"""
+            arglist = list(arglist)
+            hashes = [make_hash(args, kwargs) for args, kwargs in arglist]
+            return_values = cache.get_many(hashes)
+
+            computed = []
+            for i, return_value in enumerate(return_values):
+                if return_value is None:
+                    args, kwargs = arglist[i]
+                    return_values[i] = func(*args, **kwargs)
+                    computed.append((hashes[i], return_values[i]))
+
+            if computed:
+                cache.save_many(computed, ex=ex_seconds)
+            stats.add(hits=len(return_values) - len(computed), misses=len(computed))
+
+            return return_values
 
         @functools.wraps(func)
         def bypass(*args: t.Hashable, **kwargs: t.Hashable) -> JSONTypes:
             """Force bypass cache and update stored value"""
-            if is_class_method or is_response_method:
-                hash_ = _arg_hash(*args[1:], **kwargs)
-            else:
-                hash_ = _arg_hash(*args, **kwargs)
+            hash_ = make_hash(args, kwargs)
 
             return_value = func(*args, **kwargs)
-            cache.save(hash_, return_value, ex=expires_after)
+            cache.save(hash_, return_value, ex=ex_seconds)
 
             return return_value
 
         def cache_info() -> CacheInfo:
             """Return cache statistics"""
+            hits, misses = stats.snapshot()
             return CacheInfo(
                 hits=hits,
                 misses=misses,
                 maxsize=None,
-                currsize=len(cache),
+                currsize=cache.count(),
             )
 
         def clear_cache() -> None:
             """Clear all cached values"""
-            nonlocal hits, misses
             t.cast(Redis, redis).unlink(t.cast(str, prefix))
-            hits, misses = 0, 0
+            if l1 is not None:
+                l1.clear()
+            stats.reset()
 
         def invalidate_cache(*args: t.Hashable) -> None:
             """Invalidate records by args"""
-            nonlocal hits, misses
             hash_ = _arg_hash(*args)
             cache.delete(hash_)
+            if l1 is not None:
+                l1.discard(hash_)
 
         # Add helper methods to wrapper
         wrapper.__wrapped__ = func  # type: ignore
         wrapper.__bypass__ = bypass  # type: ignore
+        wrapper.many = many  # type: ignore
         wrapper.cache_info = cache_info  # type: ignore
         wrapper.clear_cache = clear_cache  # type: ignore
         wrapper.invalidate_cache = invalidate_cache  # type: ignore
@@ -275,11 +891,14 @@ def invalidate_cache(
 
         # Generate random prefix if none provided
         if prefix is None:
-            prefix = random_key(redis=redis)
+            prefix = random_key()
+
+        # Signature is static for a given function, so resolve it only once
+        sig = signature(func)
 
         # Get return type from function signature if not specified
         if r_type is None:
-            r_type = signature(func).return_annotation
+            r_type = sig.return_annotation
 
         # Select appropriate repository based on return type
         if is_response_method:
@@ -291,10 +910,22 @@ def invalidate_cache(
         else:
             cache = RedisRepository(redis_client=redis, prefix=prefix)
 
-        @functools.wraps(func)
-        def wrapper(*args: t.Any, **kwargs: t.Any) -> t.Any:
-            # Bind arguments to function parameters
-            bound_args = signature(func).bind(*args, **kwargs)
+        params = tuple(sig.parameters.values())
+        names = tuple(p.name for p in params)
+        defaults = {p.name: p.default for p in params if p.default is not p.empty}
+
+        # Positions of key_args in the signature. Fast path is only possible
+        # when every key arg is a regular positional-or-keyword parameter.
+        key_positions: t.Optional[t.List[int]] = None
+        if key_args is not None and all(
+            k in names and sig.parameters[k].kind is Parameter.POSITIONAL_OR_KEYWORD
+            for k in key_args
+        ):
+            key_positions = [names.index(k) for k in key_args]
+
+        def _bind_args_to_hash(args: tuple, kwargs: dict) -> t.List[t.Any]:
+            """Slow path: bind arguments to function parameters"""
+            bound_args = sig.bind(*args, **kwargs)
             bound_args.apply_defaults()
 
             # Get arguments to use for hash calculation
@@ -304,17 +935,39 @@ def invalidate_cache(
                 # If keys were not provided take all arguments
                 hash_args = bound_args.arguments
 
-            args_to_hash = list(hash_args.values())
+            return list(hash_args.values())
+
+        @functools.wraps(func)
+        def wrapper(*args: t.Any, **kwargs: t.Any) -> t.Any:
+            if key_positions is None:
+                args_to_hash = _bind_args_to_hash(args, kwargs)
+            else:
+                # Fast path: pick key args directly without binding
+                try:
+                    args_to_hash = [
+                        args[i]
+                        if i < len(args)
+                        else kwargs[k]
+                        if k in kwargs
+                        else defaults[k]
+                        for i, k in zip(key_positions, key_args)
+                    ]
+                except KeyError:
+                    # Missing required argument, let bind raise proper TypeError
+                    args_to_hash = _bind_args_to_hash(args, kwargs)
 
             # Skip first argument for methods
             if key_args is not None and (is_class_method or is_response_method):
                 args_to_hash = args_to_hash[1:]
 
+            # Calculate hash before the call, so unhashable arguments fail
+            # before any side effect and mutations by func do not change it
+            hash_ = _arg_hash(*args_to_hash)
+
             # Call original function
             return_value = func(*args, **kwargs)
 
-            # Calculate hash and invalidate cache entry
-            hash_ = _arg_hash(*args_to_hash)
+            # Invalidate cache entry
             cache.delete(hash_)
 
             return return_value
@@ -1,15 +1,131 @@
 import datetime
-import json
+import functools
+import logging
+import os
+import random
+import threading
 import typing as t
 import uuid
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from inspect import isclass
 
+import msgpack
+import zstandard as zstd
+from pydantic import VERSION as PYDANTIC_VERSION
 from pydantic import BaseModel
 from redis import Redis
 
 from src.utils import Serializer
 
+_PYDANTIC_V2 = PYDANTIC_VERSION.startswith("2.")
+if _PYDANTIC_V2:
+    from pydantic import TypeAdapter
+else:
+    from pydantic.fields import SHAPE_LIST, SHAPE_SINGLETON, ModelField
+    from pydantic.json import pydantic_encoder
+
 _T = t.TypeVar("_T", bound=BaseModel)
-_TWO_WEEKS = datetime.timedelta(weeks=2)
+_TWO_WEEKS_S = 14 * 24 * 3600
+# Expiration accepted by redis-py, either seconds or timedelta
+_Expiry = t.Union[int, datetime.timedelta]
+
+# Per-process RNG for intermediate keys, seeded from os.urandom once per
+# process instead of calling it for every key as uuid4 does
+_rng = random.Random(os.urandom(16))
+# Forked workers would otherwise share RNG state and generate the same keys
+os.register_at_fork(after_in_child=lambda: _rng.seed(os.urandom(16)))
+
+
+def _fast_uuid() -> str:
+    """128-bit random hex key from RNG seeded with 128 bits of OS entropy"""
+    return f"{_rng.getrandbits(64):016x}{_rng.getrandbits(64):016x}"
+
+
+# Payloads larger than this are zstd-compressed when compression is enabled
+_COMPRESS_MIN_SIZE = 1024
+# Compressed payloads are recognized by zstd frame magic number, JSON and
+# msgpack maps never start with it
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+# Optional dictionary trained on typical payloads, improves ratio on small JSON
+_zstd_dict_path = os.environ.get("ZSTD_DICT_PATH")
+_zstd_dict = None
+if _zstd_dict_path:
+    with open(_zstd_dict_path, "rb") as f:
+        _zstd_dict = zstd.ZstdCompressionDict(f.read())
+
+# zstd contexts are not thread-safe, so each thread gets its own pair
+_zstd_local = threading.local()
+
+
+def _zstd_contexts() -> t.Tuple[zstd.ZstdCompressor, zstd.ZstdDecompressor]:
+    try:
+        return _zstd_local.contexts
+    except AttributeError:
+        _zstd_local.contexts = (
+            zstd.ZstdCompressor(level=3, dict_data=_zstd_dict),
+            zstd.ZstdDecompressor(dict_data=_zstd_dict),
+        )
+        return _zstd_local.contexts
+
+
+logger = logging.getLogger(__name__)
+
+# Background writer for fire-and-forget saves, keeps SET off the caller's path
+_writer = ThreadPoolExecutor(max_workers=4, thread_name_prefix="redis-writer")
+# Last pending background write per (redis client, key). Shared between
+# repository instances, so deletes from any instance are ordered after writes.
+_pending: t.Dict[t.Tuple[int, bytes], "Future[t.Any]"] = {}
+_pending_lock = threading.RLock()  # cancel() runs done callbacks synchronously
+
+
+def _reset_writer() -> None:
+    """
+    Forked child inherits executor that counts parent's threads as alive and
+    never starts its own, so writer and pending registry are recreated
+    """
+    global _writer, _pending, _pending_lock
+    _writer = ThreadPoolExecutor(max_workers=4, thread_name_prefix="redis-writer")
+    _pending = {}
+    _pending_lock = threading.RLock()
+
+
+os.register_at_fork(after_in_child=_reset_writer)
+
+
+def _write_after(
+    previous: t.Optional["Future[t.Any]"],
+    redis_client: "Redis[bytes]",
+    r_key: bytes,
+    r_value: bytes,
+    ex: t.Optional[_Expiry],
+) -> t.Any:
+    # Previous write of the same key is already running, do not overtake it
+    if previous is not None:
+        wait([previous])
+    return redis_client.set(r_key, r_value, ex=ex)
+
+
+def _on_write_done(pending_key: t.Tuple[int, bytes], future: "Future[t.Any]") -> None:
+    with _pending_lock:
+        if _pending.get(pending_key) is future:
+            del _pending[pending_key]
+
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning(
+            "Failed to save %r in background",
+            pending_key[1],
+            exc_info=future.exception(),
+        )
+
+
+def _escape_glob(pattern: str) -> str:
+    """Escape characters special in Redis glob-style patterns"""
+    return "".join("\\" + ch if ch in "\\*?[]" else ch for ch in pattern)
+
+
+def _decodes_responses(redis_client: "Redis[t.Any]") -> bool:
+    pool = getattr(redis_client, "connection_pool", None)
+    return bool(pool and pool.connection_kwargs.get("decode_responses"))
 
 
 class RedisRepository(Serializer):
@@ -19,55 +135,137 @@ class RedisRepository(Serializer):
     :param redis_client: Redis client
     :param prefix: Redis key prefix for every key. If None then name of object (_T)
                    treated as prefix.
+    :param compress: Whether to zstd-compress large payloads
     """
 
-    _redis_client: "Redis[str]"
+    _redis_client: "Redis[bytes]"
     _prefix: str
+    _prefix_b: bytes
 
     def __init__(
         self,
-        redis_client: "Redis[str]",
+        redis_client: "Redis[bytes]",
         prefix: str = "",
+        compress: bool = False,
     ) -> None:
         """
         Init method sets redis client and extracts object type from
         typing annotation.
         """
+        if compress and _decodes_responses(redis_client):
+            raise ValueError(
+                "Compressed payloads are binary, "
+                "redis client must be created with decode_responses=False"
+            )
         self._redis_client = redis_client
         self._prefix = prefix
+        self._prefix_b = prefix.encode()
+        self._compress = compress
 
-    def _deserialize(self, encoded_value: t.Union[str, bytes]) -> t.Any:
-        if isinstance(encoded_value, bytes):
-            string = encoded_value.decode()
-        else:
-            string = encoded_value
+    def _key(self, key: t.Union[str, uuid.UUID]) -> bytes:
+        """Build redis key, exact type check skips str() dispatch for str keys"""
+        return self._prefix_b + (key.encode() if type(key) is str else str(key).encode())
 
-        decoded_value = json.loads(string)
-        return decoded_value
+    def _encode(self, obj: t.Any) -> bytes:
+        """
+        Serializes object, if compression is enabled payloads above
+        _COMPRESS_MIN_SIZE are compressed with zstd
+        """
+        r_value = self._serialize(obj)
+        if self._compress and len(r_value) > _COMPRESS_MIN_SIZE:
+            return _zstd_contexts()[0].compress(r_value)
+        return r_value
+
+    def _decode(self, r_value: bytes) -> t.Any:
+        # Checked regardless of `compress`, so repositories with different
+        # settings can read the same prefix
+        if r_value[:4] == _ZSTD_MAGIC:
+            return self._deserialize(_zstd_contexts()[1].decompress(r_value))
+        return self._deserialize(r_value)
 
     def save(
         self,
         key: t.Union[str, uuid.UUID],
         obj: t.Any,
-        ex: t.Optional[datetime.timedelta] = _TWO_WEEKS,
+        ex: t.Optional[_Expiry] = _TWO_WEEKS_S,
     ) -> None:
         """
         Saves object in redis with passed key
 
         :param key: Object key
         :param obj: Object to be saved
-        :param ex: Expiration timedelta
+        :param ex: Expiration in seconds or timedelta
         """
-        r_key = self._prefix + str(key)
-        r_value = self._serialize(obj)
+        r_key = self._key(key)
+        r_value = self._encode(obj)
 
+        self._wait_pending(r_key)
         self._redis_client.set(r_key, r_value, ex=ex)
 
+    def _wait_pending(self, r_key: bytes) -> None:
+        """Cancels or waits for pending background write of the key"""
+        with _pending_lock:
+            future = _pending.pop((id(self._redis_client), r_key), None)
+        if future is not None and not future.cancel():
+            wait([future])
+
+    def save_async(
+        self,
+        key: t.Union[str, uuid.UUID],
+        obj: t.Any,
+        ex: t.Optional[_Expiry] = _TWO_WEEKS_S,
+    ) -> "Future[t.Any]":
+        """
+        Saves object in redis with passed key without waiting for redis reply.
+        Object is serialized right away, so later mutations of it are not
+        stored, only the write itself happens in background thread.
+        Writes of the same key are coalesced, i.e. not yet started write is
+        replaced by the newer one. Failed writes are logged.
+
+        :param key: Object key
+        :param obj: Object to be saved
+        :param ex: Expiration in seconds or timedelta
+        :return: Future of the underlying SET command
+        """
+        r_key = self._key(key)
+        r_value = self._encode(obj)
+        pending_key = (id(self._redis_client), r_key)
+
+        with _pending_lock:
+            previous = _pending.get(pending_key)
+            if previous is not None and previous.cancel():
+                previous = None
+            future = _writer.submit(
+                _write_after, previous, self._redis_client, r_key, r_value, ex
+            )
+            _pending[pending_key] = future
+
+        future.add_done_callback(functools.partial(_on_write_done, pending_key))
+        return future
+
+    def save_many(
+        self,
+        items: t.Iterable[t.Tuple[t.Union[str, uuid.UUID], t.Any]],
+        ex: t.Optional[_Expiry] = _TWO_WEEKS_S,
+    ) -> None:
+        """
+        Saves several objects in redis in one round trip
+
+        :param items: Pairs of object key and object to be saved
+        :param ex: Expiration in seconds or timedelta
+        """
+        pipe = self._redis_client.pipeline(transaction=False)
+        for key, obj in items:
+            r_key = self._key(key)
+            self._wait_pending(r_key)
+            pipe.set(r_key, self._encode(obj), ex=ex)
+        pipe.execute()
+
     def save_with_intermediate(
         self,
         keys: t.List[t.Union[str, uuid.UUID]],
         obj: _T,
-        ex: t.Optional[datetime.timedelta] = _TWO_WEEKS,
+        ex: t.Optional[_Expiry] = _TWO_WEEKS_S,
     ) -> None:
         """
         Saves object in redis with passed key with assumption of
@@ -75,11 +273,11 @@ class RedisRepository(Serializer):
 
         :param keys: List of keys for object
         :param obj: Object to be saved
-        :param ex: Expiration timedelta
+        :param ex: Expiration in seconds or timedelta
         """
-        r_keys = [self._prefix + str(key) for key in keys]
-        intermediate = str(uuid.uuid4())
-        r_value = self._serialize(obj)
+        r_keys = [self._key(key) for key in keys]
+        intermediate = self._prefix_b + _fast_uuid().encode()
+        r_value = self._encode(obj)
 
         pipe = self._redis_client.pipeline()
         for r_key in r_keys:
@@ -88,22 +286,48 @@ class RedisRepository(Serializer):
         pipe.set(intermediate, r_value, ex=ex)
         pipe.execute()
 
-    def get(self, key: t.Union[str, uuid.UUID]) -> t.Optional[t.Any]:
+    def get(
+        self,
+        key: t.Union[str, uuid.UUID],
+        ex: t.Optional[_Expiry] = None,
+    ) -> t.Optional[t.Any]:
         """
         Extracting object from redis db
 
         :param key: Object key
+        :param ex: If passed, expiration is refreshed in the same round trip (GETEX)
         :return: Object instance or None if object with such key does not exists
         """
 
-        r_key = self._prefix + str(key)
-        json_obj = self._redis_client.get(r_key)
+        r_key = self._key(key)
+        if ex is None:
+            json_obj = self._redis_client.get(r_key)
+        else:
+            json_obj = self._redis_client.getex(r_key, ex=ex)
         if json_obj is None:
             return None
 
-        r_value = self._deserialize(json_obj)
+        r_value = self._decode(json_obj)
         return r_value
 
+    def get_many(
+        self, keys: t.Sequence[t.Union[str, uuid.UUID]]
+    ) -> t.List[t.Optional[t.Any]]:
+        """
+        Extracting several objects from redis db in one round trip (MGET)
+
+        :param keys: Object keys
+        :return: Object instances in the order of keys, None for missing ones
+        """
+        if not keys:
+            return []
+
+        json_objs = self._redis_client.mget([self._key(key) for key in keys])
+        return [
+            None if json_obj is None else self._decode(json_obj)
+            for json_obj in json_objs
+        ]
+
     def get_with_intermediate(self, key: t.Union[str, uuid.UUID]) -> t.Optional[t.Any]:
         """
         Extracting object from redis db with assumption of
@@ -113,7 +337,7 @@ class RedisRepository(Serializer):
         :return: Object instance or None if object with such key does not exists
         """
 
-        r_key = self._prefix + str(key)
+        r_key = self._key(key)
         # receive intermediate key
         intermediate = self._redis_client.get(r_key)
         if intermediate is None:
@@ -123,7 +347,7 @@ class RedisRepository(Serializer):
         if json_obj is None:
             return None
 
-        return self._deserialize(json_obj)
+        return self._decode(json_obj)
 
     def delete(self, key: t.Union[str, uuid.UUID]) -> None:
         """
@@ -132,7 +356,8 @@ class RedisRepository(Serializer):
         :param key: Object key
         """
 
-        r_key = self._prefix + str(key)
+        r_key = self._key(key)
+        self._wait_pending(r_key)
         self._redis_client.delete(r_key)
 
     def delete_with_intermediate(self, *keys: t.Union[str, uuid.UUID]) -> None:
@@ -142,7 +367,9 @@ class RedisRepository(Serializer):
 
         :param keys: Object keys
         """
-        r_keys = [self._prefix + str(key) for key in keys]
+        r_keys = [self._key(key) for key in keys]
+        for r_key in r_keys:
+            self._wait_pending(r_key)
 
         intermediate = self._redis_client.get(r_keys[0])
 
@@ -161,13 +388,29 @@ class RedisRepository(Serializer):
         :param key: Object key
         :return: True if occupied else False
         """
-        r_key = self._prefix + str(key)
+        r_key = self._key(key)
         return bool(self._redis_client.exists(r_key))
 
-    def expire(self, key: t.Union[str, uuid.UUID], ex: datetime.timedelta) -> None:
-        r_key = self._prefix + str(key)
+    def expire(self, key: t.Union[str, uuid.UUID], ex: _Expiry) -> None:
+        r_key = self._key(key)
         self._redis_client.expire(r_key, time=ex)
 
+    def count(self) -> int:
+        """
+        Count objects stored under the prefix. Iterates keys with SCAN, so it
+        does not block redis, but takes time proportional to the keyspace.
+
+        :return: Number of stored objects
+        """
+        pattern = _escape_glob(self._prefix) + "*"
+        # Stampede locks of `cache` decorator are not objects
+        lock_suffix = ":lock" if _decodes_responses(self._redis_client) else b":lock"
+        return sum(
+            1
+            for r_key in self._redis_client.scan_iter(match=pattern, count=1000)
+            if not r_key.endswith(lock_suffix)
+        )
+
     def __getitem__(self, key: t.Union[str, uuid.UUID]) -> t.Optional[t.Any]:
         return self.get(key)
 
@@ -175,17 +418,82 @@ class RedisRepository(Serializer):
         self.save(key, value)
 
 
+# Field types msgpack restores as is, so validation can be skipped for them
+_NATIVE_TYPES = (str, int, float, bool, t.Any)
+
+
+def _validate_field(field: "ModelField", value: t.Any) -> t.Any:
+    validated, errors = field.validate(value, {}, loc=field.name)
+    return value if errors else validated
+
+
+@functools.lru_cache(maxsize=None)
+def _make_constructor(model: t.Type[_T]) -> t.Callable[[t.Dict[str, t.Any]], _T]:
+    """
+    Precompute constructor that rebuilds trusted model data without validation
+    (pydantic v1 only). Nested models are constructed recursively, fields of non JSON-native types
+    (datetime, UUID, ...) are still passed through their own field validator.
+    """
+    converters: t.Dict[str, t.Callable[[t.Any], t.Any]] = {}
+
+    for name, field in model.__fields__.items():
+        type_ = field.type_
+        if isclass(type_) and issubclass(type_, BaseModel):
+            # Resolved lazily, so self-referencing models do not recurse here
+            def construct_nested(v: t.Any, type_: t.Any = type_) -> t.Any:
+                return None if v is None else _make_constructor(type_)(v)
+
+            if field.shape == SHAPE_SINGLETON:
+                converters[name] = construct_nested
+            elif field.shape == SHAPE_LIST:
+                converters[name] = lambda v, c=construct_nested: (
+                    None if v is None else [c(el) for el in v]
+                )
+            else:
+                converters[name] = functools.partial(_validate_field, field)
+        elif type_ not in _NATIVE_TYPES or field.shape not in (
+            SHAPE_SINGLETON,
+            SHAPE_LIST,
+        ):
+            # Sets, tuples, etc. come back from msgpack as lists
+            converters[name] = functools.partial(_validate_field, field)
+
+    def construct(data: t.Dict[str, t.Any]) -> _T:
+        for name, convert in converters.items():
+            if name in data:
+                data[name] = convert(data[name])
+        return model.construct(**data)
+
+    return construct
+
+
 class PydanticRedisRepository(RedisRepository, t.Generic[_T]):
+    """
+    Repository for pydantic models. Models are stored as msgpack and restored
+    without parsing JSON again: on pydantic v2 with a precompiled TypeAdapter
+    validator, on v1 with construct() skipping validation, which is safe as
+    long as only this repository writes under its prefix.
+
+    msgpack payloads are binary, so redis client must be created with
+    `decode_responses=False` (default of redis-py).
+    """
+
     def __init__(
         self,
-        redis_client: "Redis[str]",
+        redis_client: "Redis[bytes]",
         prefix: t.Optional[str] = None,
         obj_type: t.Optional[_T] = None,
+        compress: bool = False,
     ) -> None:
         """
         Init method sets redis client and extracts object type from
         typing annotation.
         """
+        if _decodes_responses(redis_client):
+            raise ValueError(
+                "PydanticRedisRepository stores binary payloads, "
+                "redis client must be created with decode_responses=False"
+            )
         if obj_type is None:
             self.obj_type = t.get_args(self.__orig_bases__[0])[0]  # type: ignore
         else:
@@ -194,19 +502,32 @@ class PydanticRedisRepository(RedisRepository, t.Generic[_T]):
         super(PydanticRedisRepository, self).__init__(
             redis_client=redis_client,
             prefix=prefix or self.obj_type.__name__ + "_",
+            compress=compress,
         )
+        if _PYDANTIC_V2:
+            self._construct = TypeAdapter(self.obj_type).validate_python
+        else:
+            self._construct = _make_constructor(self.obj_type)
 
-    def _serialize(self, obj: _T) -> str:
-        return obj.json()
+    def _serialize(self, obj: _T) -> bytes:
+        if _PYDANTIC_V2:
+            return msgpack.packb(obj.model_dump(mode="json"), use_bin_type=True)
+        return msgpack.packb(obj.dict(), use_bin_type=True, default=pydantic_encoder)
 
-    def _deserialize(self, encoded_value: t.Union[str, bytes]) -> _T:
+    def _deserialize(self, encoded_value: bytes) -> _T:
         if self.obj_type is None:
             raise Exception("Object type cannot be None for PydanticRedisRepository")
 
-        return t.cast(_T, self.obj_type.parse_raw(encoded_value))
+        return self._construct(
+            msgpack.unpackb(encoded_value, raw=False, strict_map_key=False)
+        )
 
-    def get(self, key: t.Union[str, uuid.UUID]) -> t.Optional[_T]:
-        return t.cast(_T, super().get(key))
+    def get(
+        self,
+        key: t.Union[str, uuid.UUID],
+        ex: t.Optional[_Expiry] = None,
+    ) -> t.Optional[_T]:
+        return t.cast(_T, super().get(key, ex=ex))
 
     def get_with_intermediate(self, key: t.Union[str, uuid.UUID]) -> t.Optional[_T]:
         return t.cast(_T, super().get_with_intermediate(key))
@@ -1,19 +1,61 @@
 import json
+import math
 import typing as t
 
+import orjson
+from pydantic import BaseModel
 
-class JsonEncoder(json.JSONEncoder):
-    # This `t.Any` is a kostyl', in reality it should return json serializable object
-    def default(self, obj: t.Any) -> t.Any:
+
+# This `t.Any` is a kostyl', in reality it should return json serializable object
+def json_default(obj: t.Any) -> t.Any:
+    if hasattr(obj, "to_json"):
         return obj.to_json()
+    if isinstance(obj, BaseModel):
+        return obj.dict()
+    raise TypeError
+
+
+# orjson rejects integers out of 64-bit range and writes nan/inf as null, such
+# payloads are written by stdlib json instead. orjson never emits leading
+# whitespace, so the space both marks them and keeps them valid JSON.
+_STDLIB_JSON_MARK = b" "
+
+
+def _has_non_finite(obj: t.Any) -> bool:
+    if isinstance(obj, float):
+        return not math.isfinite(obj)
+    if isinstance(obj, dict):
+        return any(_has_non_finite(v) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return any(_has_non_finite(el) for el in obj)
+    if isinstance(obj, BaseModel) or hasattr(obj, "to_json"):
+        return _has_non_finite(json_default(obj))
+    return False
 
 
 class Serializer:
-    def _serialize(self, obj: t.Any) -> str:
+    def _serialize(self, obj: t.Any) -> bytes:
         try:
-            encoder = JsonEncoder if hasattr(obj, "to_json") else None
-            return json.dumps(obj, sort_keys=True, cls=encoder)
+            payload = orjson.dumps(
+                obj,
+                option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS,
+                default=json_default,
+            )
+            # Only scan for nan/inf when they could have been written as null
+            if b"null" not in payload or not _has_non_finite(obj):
+                return payload
+        except TypeError:
+            pass
+
+        try:
+            payload = json.dumps(obj, sort_keys=True, default=json_default).encode()
         except TypeError:
             raise NotImplementedError(
                 "Serialization for this object is not implemented, define `to_json` method for the object you want to cache (i.e. function result) or make sure it is JSON serializable"
             )
+        return _STDLIB_JSON_MARK + payload
+
+    def _deserialize(self, encoded_value: bytes) -> t.Any:
+        if encoded_value[:1] == _STDLIB_JSON_MARK:
+            return json.loads(encoded_value)
+        return orjson.loads(encoded_value)